@@ -1,23 +1,89 @@
 from tkinter import Tk, Canvas, Button, Label, PhotoImage, mainloop
 import os
-from PIL import ImageTk, Image  
+import queue
+from collections import deque
+from PIL import ImageTk, Image
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
 
+TMP = "./generated/tmp/"
+IDLE = "zzz.png" # shown when there is no frame to play, never removed
+FRAME_EXT = ".bmp" # extension of the frames written by Waveform.visualize
 WIDTH, HEIGHT = 800, 600
+
+
+class FrameHandler(FileSystemEventHandler):
+    """
+    Push the path of every new frame in the tmp folder to the `frames` queue.
+    """
+    def __init__(self, frames):
+        self.frames = frames
+
+    def on_created(self, event):
+        if not event.is_directory and event.src_path.endswith(FRAME_EXT):
+            self.frames.put(event.src_path)
+
+
+def pending_frames():
+    """
+    Frames already in the tmp folder, oldest first. Frame names end with their index,
+    so sorting them by name is enough.
+    """
+    with os.scandir(TMP) as it:
+        return deque(sorted(e.path for e in it if e.name.endswith(FRAME_EXT)))
+
+
+def show(path):
+    image = ImageTk.PhotoImage(Image.open(path))
+    label.configure(image=image)
+    label.image = image
+
+
 def update():
-    try:
-        image = ImageTk.PhotoImage(Image.open("./generated/tmp/"+os.listdir("./generated/tmp/")[0]))
-        label = Label(image=image)
-        label.image = image
-        # Position image
-        label.place(x=0, y=0)
-        if os.listdir("./generated/tmp/")[0] != "zzz.png":
-            os.remove("./generated/tmp/"+os.listdir("./generated/tmp/")[0])
-    except:
-        pass
+    global current, idle
+    # Scheduled first so that an error below does not stop the playback.
     master.after(50, update)
+    if current is None and backlog:
+        current = backlog.popleft()
+    elif current is None:
+        try:
+            current = frames.get_nowait()
+        except queue.Empty:
+            pass
+    if current is not None:
+        try:
+            show(current)
+        except FileNotFoundError:
+            current = None
+        except OSError:
+            # The frame is still being written, try again on next tick.
+            pass
+        else:
+            try:
+                os.remove(current)
+            except OSError:
+                pass
+            current = None
+            idle = False
+    elif not idle:
+        show(TMP + IDLE)
+        idle = True
 
 master = Tk()
+label = Label(master)
+label.place(x=0, y=0)
+frames = queue.Queue()
+current = None
+idle = False
+
+observer = Observer()
+observer.schedule(FrameHandler(frames), TMP)
+observer.start()
+# Frames written before the observer started, a frame both listed here and queued
+# by the observer is skipped the second time as it is already removed.
+backlog = pending_frames()
 
 master.after(0, update)  # begin updates
 master.mainloop()
-
+observer.stop()
+observer.join()
@@ -1,26 +1,46 @@
 from gtts import gTTS
-import random
 import os
+import threading
 from mutagen.mp3 import MP3
 
 class TextToVoice:
+    # ids are given in increasing order, shared by all instances and starting after
+    # the ones already on disk, which are only listed once.
+    _next_id = None
+    _id_lock = threading.Lock()
+
     def __init__(self, language="en", speed="fast"):
         self.lang = language
         self.speed = True if speed == "slow" else False
     
+    @staticmethod
+    def _list_ids():
+        # must be called with `_id_lock` held
+        if TextToVoice._next_id is None:
+            ids = [int(f[:-4]) for f in os.listdir("./generated/voices")
+                   if f.endswith(".mp3") and f[:-4].isdigit()]
+            TextToVoice._next_id = max(ids, default=0) + 1
+
     def get_id(self):
-        id = random.randint(0,1000000)
-        if str(id)+".mp3" in os.listdir("./generated/voices"):
-            return self.get_id()
+        with TextToVoice._id_lock:
+            TextToVoice._list_ids()
+            id = TextToVoice._next_id
+            TextToVoice._next_id += 1
         return id
 
     def generate(self, text,id=None):
         gtts = gTTS(text=text, lang=self.lang, slow=self.speed)
         if not id:  
             id = self.get_id()
+        elif str(id).isdigit():
+            # later automatic ids must not overwrite this file, other ids never collide
+            with TextToVoice._id_lock:
+                TextToVoice._list_ids()
+                TextToVoice._next_id = max(TextToVoice._next_id, int(id) + 1)
         gtts.save(f"./generated/voices/{id}.mp3")
         audio = MP3(f"./generated/voices/{id}.mp3")
-        return({"id":id, "duration":audio.info.length, "path":f"./generated/voices/{id}.mp3", "text":text})
+        return({"id":id, "duration":audio.info.length, "samplerate":audio.info.sample_rate,
+                "channels":audio.info.channels, "path":f"./generated/voices/{id}.mp3", "text":text})
 
     def delete(self, id):
         os.remove(f"./generated/voices/{id}.mp3")
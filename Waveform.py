@@ -4,13 +4,20 @@ import math
 import subprocess as sp
 import sys
 import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import cv2
-import cairo
 import numpy as np
 import tqdm
+from scipy.special import expit
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 import os
 _is_main = False
+_READ_CHUNK = 1 << 20 # bytes read at once from ffmpeg output
 
 
 def colorize(text, color):
@@ -44,25 +51,29 @@ def read_info(media):
         'ffprobe', "-loglevel", "panic",
         str(media), '-print_format', 'json', '-show_format', '-show_streams'
     ],
-                capture_output=True,shell=True)
+                capture_output=True)
     if proc.returncode:
         print(proc.stderr.decode('utf-8'))
         raise IOError(f"{media} does not exist or is of a wrong type.")
     return json.loads(proc.stdout.decode('utf-8'))
 
-def read_audio(audio, seek=None, duration=None):
+
+def read_format(audio):
     """
-    Read the `audio` file, starting at `seek` (or 0) seconds for `duration` (or all)  seconds.
-    Returns `float[channels, samples]`.
+    Return the number of channels and the sample rate of the `audio` file, using ffprobe.
     """
-    info = read_info(audio)
-    channels = None
-    stream = info['streams'][0]
+    stream = read_info(audio)['streams'][0]
     if stream["codec_type"] != "audio":
         raise ValueError(f"{audio} should contain only audio.")
-    channels = stream['channels']
-    samplerate = float(stream['sample_rate'])
+    return stream['channels'], float(stream['sample_rate'])
 
+
+def read_audio(audio, channels, samplerate, seek=None, duration=None):
+    """
+    Read the `audio` file with `channels` channels sampled at `samplerate`, starting at
+    `seek` (or 0) seconds for `duration` (or all) seconds.
+    Returns `float[channels, samples]`.
+    """
     # Good old ffmpeg
     command = ['ffmpeg', '-y']
     command += ['-loglevel', 'panic']
@@ -74,13 +85,56 @@ def read_audio(audio, seek=None, duration=None):
     command += ['-f', 'f32le']
     command += ['-']
 
-    proc = sp.run(command, check=True, capture_output=True)
-    wav = np.frombuffer(proc.stdout, dtype=np.float32)
-    return wav.reshape(-1, channels).T, samplerate
+    # Decode straight into a preallocated buffer, sized from the duration if known
+    # and grown if needed, rather than buffering the whole output as bytes first.
+    if duration is not None:
+        wav = np.empty(int(duration * samplerate + 1) * channels, dtype=np.float32)
+    else:
+        wav = np.empty(_READ_CHUNK // 4, dtype=np.float32)
+    pos = 0 # in bytes
+    proc = sp.Popen(command, stdout=sp.PIPE)
+    with proc.stdout:
+        while True:
+            if pos == wav.nbytes:
+                grown = np.empty(2 * len(wav) + 1, dtype=np.float32)
+                grown[:len(wav)] = wav
+                wav = grown
+            read = proc.stdout.readinto(memoryview(wav).cast('B')[pos:pos + _READ_CHUNK])
+            if not read:
+                break
+            pos += read
+    if proc.wait():
+        raise sp.CalledProcessError(proc.returncode, command)
+    wav = wav[:pos // wav.itemsize]
+    return wav.reshape(-1, channels).T
 
 
 def sigmoid(x):
-    return 1 / (1 + np.exp(-x))
+    return expit(x)
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _envelope_kernel(wav, block, blocks, out):
+        """
+        Sum the positive part of `wav` over consecutive blocks of `block` samples, then
+        average `blocks` consecutive blocks for each entry of `out`, followed by the sigmoid
+        compressor of `envelope`.
+        """
+        sums = np.empty(len(out) + blocks - 1)
+        for j in range(len(sums)):
+            s = 0.
+            for k in range(block):
+                v = wav[j * block + k]
+                if v > 0:
+                    s += v
+            sums[j] = s
+        window = block * blocks
+        s = sums[:blocks - 1].sum()
+        for i in range(len(out)):
+            s += sums[i + blocks - 1]
+            out[i] = 1.9 * (1. / (1. + math.exp(-2.5 * s / window)) - 0.5)
+            s -= sums[i]
 
 
 def envelope(wav, window, stride):
@@ -88,63 +142,373 @@ def envelope(wav, window, stride):
     Extract the envelope of the waveform `wav` (float[samples]), using average pooling
     with `window` samples and the given `stride`.
     """
-    # pos = np.pad(np.maximum(wav, 0), window // 2)
+    # Overlapping windows are computed from non overlapping blocks of `stride` samples,
+    # so that each sample is only read once. `window` is rounded down to a multiple
+    # of `stride`.
+    blocks = max(window // stride, 1)
     wav = np.pad(wav, window // 2)
-    out = []
-    for off in range(0, len(wav) - window, stride):
-        frame = wav[off:off + window]
-        out.append(np.maximum(frame, 0).mean())
-    out = np.array(out)
-    # Some form of audio compressor based on the sigmoid.
-    out = 1.9 * (sigmoid(2.5 * out) - 0.5)
+    count = len(range(0, len(wav) - window, stride))
+    if njit is not None:
+        out = np.empty(count, dtype=np.float32)
+        _envelope_kernel(wav, stride, blocks, out)
+    else:
+        n_blocks = count + blocks - 1
+        sums = np.maximum(wav[:n_blocks * stride], 0).reshape(n_blocks, stride)
+        sums = sums.sum(axis=1, dtype=np.float64)
+        sums = np.concatenate([[0.], np.cumsum(sums)])
+        out = (sums[blocks:] - sums[:-blocks]) / (blocks * stride)
+        # Some form of audio compressor based on the sigmoid.
+        out = (1.9 * (sigmoid(2.5 * out) - 0.5)).astype(np.float32)
     return out
 
 
-def draw_env(envs, out, fg_colors, bg_color, size):
+def bar_layout(bars, waves, size, pad_ratio=0.1):
     """
-    Internal function, draw a single frame (two frames for stereo) using cairo and save
-    it to the `out` file as png. envs is a list of envelopes over channels, each env
-    is a float[bars] representing the height of the envelope to draw. Each entry will
-    be represented by a bar.
+    Pixel geometry shared by all the frames of a given `size`: the index of the bar
+    covering each pixel column (-1 between bars) among the `bars` bars, and the midrule
+    row of each of the `waves` waves (waves are stacked vertically). Bars are centered on
+    a regular grid, with `pad_ratio` of their width as spacing.
+    Returns `(int[width], int[waves])`.
     """
-    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, *size)
-    ctx = cairo.Context(surface)
-    ctx.scale(*size)
-
-    ctx.set_source_rgb(*bg_color)
-    ctx.rectangle(0, 0, 1, 1)
-    ctx.fill()
-
-    K = len(envs) # Number of waves to draw (waves are stacked vertically)
-    T = len(envs[0]) # Numbert of time steps
-    pad_ratio = 0.1 # spacing ratio between 2 bars
-    width = 1. / (T * (1 + 2 * pad_ratio))
+    W, H = size
+    width = 1. / (bars * (1 + 2 * pad_ratio))
     pad = pad_ratio * width
     delta = 2 * pad + width
+    centers = pad + np.arange(bars) * delta
+    x0s = np.clip(np.round((centers - width / 2) * W), 0, W).astype(int)
+    x1s = np.clip(np.round((centers + width / 2) * W), 0, W).astype(int)
+    x1s = np.maximum(x1s, x0s + 1)
+    columns = np.full(W, -1)
+    for step in range(bars):
+        columns[x0s[step]:x1s[step]] = step
+    midrules = (1 + 2 * np.arange(waves)) * H // (2 * waves)
+    return columns, midrules
+
+
+def to_u8(color):
+    """
+    Convert a float rgb color in [0, 1] to uint8.
+    """
+    return np.round(np.clip(color, 0, 1) * 255).astype(np.uint8)
 
-    ctx.set_line_width(width)
-    for step in range(T):
-        for i in range(K):
-            half = 0.5 * envs[i][step] # (semi-)height of the bar
-            half /= K # as we stack K waves vertically
-            midrule = (1+2*i)/(2*K) # midrule of i-th wave
-            ctx.set_source_rgb(*fg_colors[i])
-            ctx.move_to(pad + step * delta, midrule - half)
-            ctx.line_to(pad + step * delta, midrule)
-            ctx.stroke()
-            ctx.set_source_rgba(*fg_colors[i], 0.8)
-            ctx.move_to(pad + step * delta, midrule)
-            ctx.line_to(pad + step * delta, midrule + 0.9 * half)
-            ctx.stroke()
-    surface.write_to_png(out)
+
+def bar_colors(fg_colors, bg_color):
+    """
+    Return, for each wave, the uint8 rgb colors of the upper and of the lower half of
+    its bars. `fg_colors` and `bg_color` are uint8 rgb colors.
+    """
+    colors = []
+    for fg in fg_colors:
+        # lower half is drawn with alpha 0.8 over the background
+        fg2 = np.round(0.8 * fg + 0.2 * bg_color).astype(np.uint8)
+        colors.append((fg, fg2))
+    return colors
+
+
+def draw_env_rgb(envs, layout, colors, bg_color, size):
+    """
+    Internal function, draw a single frame (two frames for stereo) in a uint8 rgb buffer
+    and return it as `uint8[height, width, 3]`. envs is a list of envelopes over channels,
+    each env is a float[bars] representing the height of the envelope to draw. Each entry
+    will be represented by a bar placed according to `layout` (see `bar_layout`), with
+    the `colors` given by `bar_colors`.
+    """
+    W, H = size
+    K = len(envs) # Number of waves to draw (waves are stacked vertically)
+    T = len(envs[0]) # Number of time steps
+    columns, midrules = layout
+    palette = np.array([bg_color] + [color for pair in colors[:K] for color in pair])
+
+    # All the pixel columns of a bar are the same, so the bars are first drawn one pixel
+    # wide, as indices in `palette`, with an extra background column for the gaps.
+    labels = np.zeros((H, T + 1), dtype=np.uint8)
+    rows = np.arange(H)[:, None]
+    for i in range(K):
+        midrule = midrules[i]
+        halves = (0.5 * H * envs[i] / K).astype(int) # (semi-)height of the bars in pixels
+        lows = (0.9 * halves).astype(int)
+        bars = labels[:, :T]
+        bars[(rows >= midrule - halves) & (rows < midrule)] = 2 * i + 1
+        bars[(rows >= midrule) & (rows < midrule + lows)] = 2 * i + 2
+    # Then widened to the full frame, the gaps (-1) pick the last column.
+    return np.take(np.take(palette, labels, axis=0), columns, axis=1)
+
+
+_GL_VERTEX = """
+#version 330
+in vec2 in_pos;
+void main() {
+    gl_Position = vec4(in_pos, 0.0, 1.0);
+}
+"""
+
+# Same rasterization as `draw_env_rgb`, evaluated for each pixel. Rows are counted from
+# the bottom in OpenGL, but as `fbo.read` also starts with the bottom row, the returned
+# buffer has the same layout as with NumPy.
+_GL_FRAGMENT = """
+#version 330
+uniform sampler2D envs; // heights, one row per wave
+uniform sampler2D columns; // bar index of each pixel column, -1 between bars
+uniform int waves;
+uniform int height;
+uniform int midrules[2];
+uniform vec3 fg[2];
+uniform vec3 fg2[2];
+uniform vec3 bg;
+out vec3 color;
+void main() {
+    int x = int(gl_FragCoord.x);
+    int y = int(gl_FragCoord.y);
+    int bar = int(texelFetch(columns, ivec2(x, 0), 0).r);
+    color = bg;
+    if (bar < 0) {
+        return;
+    }
+    for (int i = 0; i < waves; i++) {
+        int midrule = midrules[i];
+        int extent = int(0.5 * height * texelFetch(envs, ivec2(bar, i), 0).r / waves);
+        if (y >= midrule - extent && y < midrule) {
+            color = fg[i];
+        } else if (y >= midrule && y < midrule + int(0.9 * extent)) {
+            color = fg2[i];
+        }
+    }
+}
+"""
+
+
+class GLRenderer:
+    """
+    Draw frames on the GPU with an OpenGL fragment shader, in an offscreen moderngl
+    context. Each frame takes a single draw call, the bar heights being uploaded
+    as a texture. Requires the optional `moderngl` package.
+    """
+    def __init__(self, colors, bg_color, size, bars, layout):
+        import moderngl
+        columns, midrules = layout
+        waves = len(midrules)
+        self.size = size
+        self.ctx = moderngl.create_standalone_context()
+        try:
+            self.fbo = self.ctx.simple_framebuffer(size, components=3)
+            self.envs = self.ctx.texture((bars, waves), 1, dtype='f4')
+            columns = columns.astype(np.float32)
+            self.columns = self.ctx.texture((size[0], 1), 1, columns.tobytes(), dtype='f4')
+
+            self.program = self.ctx.program(vertex_shader=_GL_VERTEX, fragment_shader=_GL_FRAGMENT)
+            self.program['envs'] = 0
+            self.program['columns'] = 1
+            self.program['waves'] = waves
+            self.program['height'] = size[1]
+            self.program['midrules'].value = list(midrules) + [0] * (2 - waves)
+            self.program['fg'].value = [tuple(top / 255) for top, _ in colors]
+            self.program['fg2'].value = [tuple(bottom / 255) for _, bottom in colors]
+            self.program['bg'].value = tuple(bg_color / 255)
+            self.quad = self.ctx.buffer(np.array([-1, -1, 1, -1, -1, 1, 1, 1], dtype=np.float32))
+            self.vao = self.ctx.vertex_array(self.program, self.quad, 'in_pos')
+        except Exception:
+            # e.g. a shader that does not compile, do not leak the context.
+            self.ctx.release()
+            raise
+        self.mode = moderngl.TRIANGLE_STRIP
+
+    def render(self, envs):
+        """
+        Draw a single frame, see `draw_env_rgb`.
+        """
+        W, H = self.size
+        self.envs.write(np.ascontiguousarray(envs, dtype=np.float32))
+        self.envs.use(0)
+        self.columns.use(1)
+        self.fbo.use()
+        self.vao.render(self.mode)
+        return np.frombuffer(self.fbo.read(components=3), dtype=np.uint8).reshape(H, W, 3)
+
+    def release(self):
+        """
+        Free the GPU objects and the OpenGL context, the renderer cannot be used after.
+        """
+        for obj in [self.vao, self.quad, self.program, self.envs, self.columns, self.fbo]:
+            obj.release()
+        self.ctx.release()
 
 
 def interpole(x1, y1, x2, y2, x):
     return y1 + (y2 - y1) * (x - x1) / (x2 - x1)
 
 
+def take_steps(envs, steps):
+    """
+    Return `envs[:, steps]` for `envs` a float[channels, steps], with zeros for the
+    steps that fall outside of it.
+    """
+    out = envs.take(steps, axis=1, mode='clip')
+    out[:, (steps < 0) | (steps >= envs.shape[1])] = 0
+    return out
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _blend_kernel(envs, offs, locs, bars, speed, smooth, out):
+        """
+        Fused version of the blending in `frame_envs`, one frame and channel at a time,
+        written into `out`.
+        """
+        steps = envs.shape[1]
+        for f in range(out.shape[0]):
+            start = offs[f] * bars - bars // 2
+            for c in range(out.shape[1]):
+                # we want loud parts to be updated faster
+                loudest = 0. # envelopes are never negative
+                for i in range(bars):
+                    k = start + bars + i
+                    v = envs[c, k] if 0 <= k < steps else 0.
+                    loudest = max(loudest, v)
+                maxvol = math.log10(1e-4 + loudest) * 10
+                # interpole(-6, 0.5, 0, 2, maxvol), clipped to [0.5, 2]
+                speedup = min(max(0.5 + 1.5 * (maxvol + 6) / 6, 0.5), 2.)
+                w = 1. / (1. + math.exp(-speed * speedup * (locs[f] - 0.5)))
+                for i in range(bars):
+                    k = start + i
+                    env1 = envs[c, k] if 0 <= k < steps else 0.
+                    env2 = envs[c, k + bars] if 0 <= k + bars < steps else 0.
+                    out[f, c, i] = ((1 - w) * env1 + w * env2) * smooth[i]
+
+
+def frame_envs(envs, frames, rate, sr, stride, bars, speed, smooth):
+    """
+    Compute the envelopes to draw on each of the `frames` frames at once, blending between
+    the two blocks of `bars` steps of `envs` (float[channels, steps]) around the time of
+    the frame. Returns float[frames, channels, bars].
+    """
+    pos = ((np.arange(frames) / rate) * sr) / stride / bars
+    off = pos.astype(int)
+    loc = (pos - off).astype(np.float32)
+    if njit is not None:
+        out = np.empty((frames, len(envs), bars), dtype=np.float32)
+        _blend_kernel(envs, off, loc, bars, float(speed), smooth, out)
+        return out
+    # The first frame is centered on the start of the audio, steps out of `envs`
+    # are silent.
+    steps = off[:, None] * bars + np.arange(bars) - bars // 2
+    env1 = take_steps(envs, steps) # float[channels, frames, bars]
+    env2 = take_steps(envs, steps + bars)
+
+    # we want loud parts to be updated faster
+    maxvol = np.log10(1e-4 + env2.max(axis=-1)) * 10
+    speedup = np.clip(interpole(-6, 0.5, 0, 2, maxvol), 0.5, 2)
+    w = sigmoid(speed * speedup * (loc - 0.5))[..., None]
+    denvs = (1 - w) * env1 + w * env2
+    denvs *= smooth
+    return denvs.transpose(1, 0, 2)
+
+
+def torch_frames(wavs, window, stride, frames, rate, sr, bars, speed, smooth, layout,
+                 colors, bg_color, size, batch=64):
+    """
+    Same as `envelope`, `frame_envs` and `draw_env_rgb` but as batched tensor ops with
+    PyTorch, on the GPU if one is available. Frames are drawn `batch` at a time and
+    yielded one by one as `uint8[height, width, 3]`. Requires the optional `torch` package.
+    """
+    import torch
+    import torch.nn.functional as F
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    W, H = size
+    columns, midrules = layout
+    K = len(wavs)
+
+    # Envelopes, average pooling over windows rounded down to a multiple of `stride`
+    # as in `envelope`.
+    wav = torch.as_tensor(np.stack(wavs), device=device)
+    wav = F.pad(wav, (window // 2, window // 2))
+    count = len(range(0, wav.shape[1] - window, stride))
+    envs = F.avg_pool1d(torch.relu(wav)[:, None], max(window // stride, 1) * stride, stride)
+    envs = envs[:, 0, :count]
+    # Some form of audio compressor based on the sigmoid.
+    envs = 1.9 * (torch.sigmoid(2.5 * envs) - 0.5)
+
+    # Blending, see `frame_envs`.
+    pos = ((torch.arange(frames, device=device, dtype=torch.float64) / rate) * sr) / stride / bars
+    off = pos.long()
+    loc = (pos - off).float()
+    steps = off[:, None] * bars + torch.arange(bars, device=device) - bars // 2
+    valid = (steps >= 0) & (steps < count)
+    env1 = envs[:, steps.clamp(0, count - 1)] * valid # float[channels, frames, bars]
+    valid = (steps + bars >= 0) & (steps + bars < count)
+    env2 = envs[:, (steps + bars).clamp(0, count - 1)] * valid
+    maxvol = torch.log10(1e-4 + env2.amax(dim=-1)) * 10
+    speedup = interpole(-6, 0.5, 0, 2, maxvol).clamp(0.5, 2)
+    w = torch.sigmoid(speed * speedup * (loc - 0.5))[..., None]
+    denvs = (1 - w) * env1 + w * env2
+    denvs *= torch.as_tensor(smooth, device=device)
+    denvs = denvs.transpose(0, 1)
+
+    # Drawing, each pixel column looks up the height of its bar, see `draw_env_rgb`.
+    columns = torch.as_tensor(columns, device=device)
+    inside = columns >= 0
+    columns = columns.clamp(min=0)
+    ys = torch.arange(H, device=device)[:, None]
+    colors = torch.as_tensor(np.array(colors), device=device)
+    bg_color = torch.as_tensor(bg_color, device=device)
+    for start in range(0, frames, batch):
+        chunk = denvs[start:start + batch]
+        halves = (0.5 * H * chunk / K).int() # (semi-)height of the bars in pixels
+        lows = halves * 9 // 10 # same as int(0.9 * half), without float32 rounding
+        img = bg_color.expand(len(chunk), H, W, 3).clone()
+        for i in range(K):
+            midrule = int(midrules[i])
+            half = halves[:, i, columns][:, None]
+            low = lows[:, i, columns][:, None]
+            img[(ys >= midrule - half) & (ys < midrule) & inside] = colors[i, 0]
+            img[(ys >= midrule) & (ys < midrule + low) & inside] = colors[i, 1]
+        yield from img.cpu().numpy()
+
+
+def _encode_frame(img, encode):
+    if encode:
+        # Frames in tmp are read back once and deleted, an uncompressed bmp is the cheapest.
+        return cv2.imencode(".bmp", img[..., ::-1])[1].tobytes()
+    return img.tobytes()
+
+
+# Arguments shared by all the frames, set once per worker process by `_init_frame_worker`.
+_frame_args = None
+
+
+def _init_frame_worker(args):
+    global _frame_args
+    _frame_args = args
+
+
+def _render_frame(idx):
+    """
+    Internal function, draw frame `idx` and return it as raw rgb bytes, or encoded as bmp
+    if `encode` is set in the shared arguments.
+    """
+    denvs, layout, colors, bg_color, size, encode = _frame_args
+    return _encode_frame(draw_env_rgb(denvs[idx], layout, colors, bg_color, size), encode)
+
+
+def _bounded_map(pool, fn, items, inflight):
+    """
+    Like `pool.map(fn, items)`, results in order, but with at most `inflight` calls
+    submitted at once, so that finished results do not pile up in memory when
+    they are consumed slower than they are produced.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= inflight:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
 def visualize(audioID,
               tmp=Path("./generated/tmp/"),
+              out=None,
+              channels=None,
+              samplerate=None,
               seek=None,
               duration=None,
               rate=20,
@@ -157,10 +521,16 @@ def visualize(audioID,
               bg_color=(1, 1, 1),
               size=(400, 400),
               stereo=False,
+              jobs=None,
+              renderer="numpy",
               ):
     """
     Generate the visualisation for the `audio` file, using a `tmp` folder and saving the final
     video in `out`.
+    If `out` is None, frames are only dumped as bmp in `tmp`, otherwise they are piped
+    straight to ffmpeg and nothing is written to `tmp`.
+    `channels` and `samplerate` describe the audio file, as returned by
+        `TextToVoice.generate`. If not given, they are read with ffprobe.
     `seek` and `durations` gives the extract location if any.
     `rate` is the framerate of the output video.
 
@@ -174,13 +544,22 @@ def visualize(audioID,
     `bg_color` is the rgb color to use for the background.
     `size` is the `(width, height)` in pixels to generate.
     `stereo` is whether to create 2 waves.
+    `jobs` is the number of processes drawing frames, defaults to the number of cpus.
+        Use 1 to draw them in the current process.
+    `renderer` is either "numpy", "gl" to draw the frames on the GPU with OpenGL
+        (requires moderngl), or "torch" to run the whole pipeline as batched tensor ops
+        on the GPU if available (requires torch). With "gl" and "torch", frames are
+        drawn in the current process.
     """
     audio = f"./generated/voices/{audioID}.mp3"
     try:
-        wav, sr = read_audio(audio, seek=seek, duration=duration)
+        if channels is None or samplerate is None:
+            channels, samplerate = read_format(audio)
+        wav = read_audio(audio, channels, samplerate, seek=seek, duration=duration)
     except (IOError, ValueError) as err:
         fatal(err)
         raise
+    sr = float(samplerate)
     # wavs is a list of wav over channels
     wavs = []
     if stereo:
@@ -195,52 +574,88 @@ def visualize(audioID,
 
     window = int(sr * time / bars)
     stride = int(window / oversample)
-    # envs is a list of env over channels
-    envs = []
-    for wav in wavs:
-        env = envelope(wav, window, stride)
-        env = np.pad(env, (bars // 2, 2 * bars))
-        envs.append(env)
 
     duration = len(wavs[0]) / sr
     frames = int(rate * duration)
-    smooth = np.hanning(bars)
+    smooth = np.hanning(bars).astype(np.float32)
+    bg_color = to_u8(bg_color)
+    colors = bar_colors((to_u8(fg_color), to_u8(fg_color2)), bg_color)
+    layout = bar_layout(bars, len(wavs), size)
 
     print("Generating the frames...")
-    for idx in tqdm.tqdm(range(frames), unit=" frames", ncols=80):
-        pos = (((idx / rate)) * sr) / stride / bars
-        off = int(pos)
-        loc = pos - off
-        denvs = []
-        for env in envs:
-            env1 = env[off * bars:(off + 1) * bars]
-            env2 = env[(off + 1) * bars:(off + 2) * bars]
-
-            # we want loud parts to be updated faster
-            maxvol = math.log10(1e-4 + env2.max()) * 10
-            speedup = np.clip(interpole(-6, 0.5, 0, 2, maxvol), 0.5, 2)
-            w = sigmoid(speed * speedup * (loc - 0.5))
-            denv = (1 - w) * env1 + w * env2
-            denv *= smooth
-            denvs.append(denv)
-        draw_env(denvs, tmp / f"{audioID}-{idx:06d}.png", (fg_color, fg_color2), bg_color, size)
-
-    audio_cmd = []
-    if seek is not None:
-        audio_cmd += ["-ss", str(seek)]
-    if duration is not None:
-        audio_cmd += ["-t", str(duration)]
-    # print("Encoding the animation video... ")
-
-    # images = [img for img in os.listdir(tmp) if img.endswith(".png")]
-    # frame = cv2.imread(os.path.join(tmp, images[0]))
-    # height, width, layers = frame.shape
-    # video = cv2.VideoWriter(audio.replace(".mp3",".mp4"), 0, rate, (width,height))
-    # for image in images:
-    #     video.write(cv2.imread(os.path.join(tmp, image)))
-    # video.release()
-    # for i in images:
-    #     os.remove(os.path.join(tmp, i))
+    # Frames are only encoded when dumped to `tmp`, ffmpeg takes them raw.
+    encode = out is None
+    pool = None
+    gl = None
+    if renderer == "torch":
+        images = torch_frames(wavs, window, stride, frames, rate, sr, bars, speed, smooth,
+                              layout, colors, bg_color, size)
+        rendered = (_encode_frame(img, encode) for img in images)
+    else:
+        # envs is float[channels, steps], all channels in a single contiguous array
+        envs = np.stack([envelope(wav, window, stride) for wav in wavs])
+        envs = envs.astype(np.float32, copy=False)
+        denvs = frame_envs(envs, frames, rate, sr, stride, bars, speed, smooth)
+        args = (denvs, layout, colors, bg_color, size, encode)
+        # Frames only depend on `denvs[idx]`, so they are drawn in parallel. They are
+        # yielded in order, which both ffmpeg and the tmp folder consumer rely on.
+        if renderer == "gl":
+            gl = GLRenderer(colors, bg_color, size, bars, layout)
+            rendered = (_encode_frame(gl.render(denv), encode) for denv in denvs)
+        elif jobs == 1:
+            _init_frame_worker(args)
+            rendered = map(_render_frame, range(frames))
+        else:
+            jobs = jobs or os.cpu_count()
+            pool = ProcessPoolExecutor(jobs, initializer=_init_frame_worker, initargs=(args,))
+            rendered = _bounded_map(pool, _render_frame, range(frames), 2 * jobs)
+    proc = None
+    done = False
+    try:
+        # ffmpeg is only started once the rendering is set up, so that a failure there
+        # does not leave it running, writing a video with no frames.
+        if out is not None:
+            audio_cmd = []
+            if seek is not None:
+                audio_cmd += ["-ss", str(seek)]
+            if duration is not None:
+                audio_cmd += ["-t", str(duration)]
+            # Raw frames go through a pipe to ffmpeg, which muxes them with the audio.
+            command = ['ffmpeg', '-y', '-loglevel', 'panic']
+            command += ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{size[0]}x{size[1]}']
+            command += ['-r', str(rate), '-i', '-']
+            command += audio_cmd + ['-i', audio]
+            command += ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p']
+            command += [str(out)]
+            # Large buffer so that writing a frame does not stall on a small pipe buffer.
+            proc = sp.Popen(command, stdin=sp.PIPE, bufsize=10**8)
+        for idx, data in enumerate(tqdm.tqdm(rendered, total=frames, unit=" frames", ncols=80)):
+            if proc is None:
+                (tmp / f"{audioID}-{idx:06d}.bmp").write_bytes(data)
+            else:
+                try:
+                    proc.stdin.write(data)
+                except BrokenPipeError:
+                    raise IOError(f"ffmpeg could not encode {out}.")
+        done = True
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if gl is not None:
+            gl.release()
+        if proc is not None and not done:
+            # Do not let ffmpeg finish a truncated video.
+            proc.kill()
+            proc.wait()
+
+    if proc is not None:
+        print("Encoding the animation video... ")
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass # ffmpeg already exited, its return code tells what happened
+        if proc.wait():
+            raise IOError(f"ffmpeg could not encode {out}.")
 
 def parse_color(colorstr):
     """